@@ -7,70 +7,95 @@ import contextlib
 import logging
 from contextlib import asynccontextmanager
 
+import httpx
 import uvicorn
 from fastapi import FastAPI
+from fastapi.responses import Response
 
 from src.config import get_settings, setup_logging
 from src.mailer import CHECK_INTERVAL_SECONDS, MenuMailer
 from src.menu_index import MenuIndex
 
 
-setup_logging()
-logger = logging.getLogger("menu-mailer")
-
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    settings = get_settings()
-    index = MenuIndex(settings.menu_image_dir)
+    settings = getattr(app.state, "settings", None) or get_settings()
+    setup_logging(settings)
+    logger = logging.getLogger("menu-mailer")
+    app.state.logger = logger
+
+    index = MenuIndex(settings.menu_image_dir, logger=logger.getChild("index"))
     index.scan()
 
-    mailer = MenuMailer(settings, index)
+    http = httpx.AsyncClient(
+        limits=httpx.Limits(max_keepalive_connections=4, max_connections=8),
+        timeout=10.0,
+    )
+    mailer = MenuMailer(settings, index, http, logger=logger)
 
     app.state.index = index
     app.state.mailer = mailer
     app.state.settings = settings
+    app.state.http = http
+    app.state.wake = asyncio.Event()
+    # Serialises tick() and send_now(), which yield while SMTP runs in a thread.
+    app.state.send_lock = asyncio.Lock()
+
+    async def periodic_loop() -> None:
+        loop = asyncio.get_running_loop()
+        wake = app.state.wake
+        send_lock = app.state.send_lock
+        scan_interval = settings.scan_interval_seconds
+        next_scan = loop.time() + scan_interval if scan_interval > 0 else None
+        next_tick = loop.time()
 
-    scan_task = None
-    mailer_task = None
-
-    if settings.scan_interval_seconds > 0:
-
-        async def scan_loop() -> None:
-            while True:
-                await asyncio.sleep(settings.scan_interval_seconds)
+        while True:
+            now = loop.time()
+            if next_scan is not None and now >= next_scan:
                 try:
-                    index.scan()
+                    await asyncio.to_thread(index.scan)
                 except Exception:
                     logger.exception("Failed to scan menu image directory")
+                next_scan = now + scan_interval
 
-        scan_task = asyncio.create_task(scan_loop())
+            if now >= next_tick:
+                try:
+                    async with send_lock:
+                        await mailer.tick()
+                    next_tick = loop.time() + mailer.next_wake()
+                except Exception:
+                    logger.exception("Mailer loop error")
+                    next_tick = loop.time() + CHECK_INTERVAL_SECONDS
 
-    async def mailer_loop() -> None:
-        while True:
+            wake_at = next_tick if next_scan is None else min(next_tick, next_scan)
             try:
-                mailer.tick()
-            except Exception:
-                logger.exception("Mailer loop error")
-            await asyncio.sleep(CHECK_INTERVAL_SECONDS)
+                await asyncio.wait_for(wake.wait(), timeout=max(wake_at - loop.time(), 0))
+                wake.clear()
+                next_tick = loop.time()
+            except asyncio.TimeoutError:
+                pass
 
-    mailer_task = asyncio.create_task(mailer_loop())
+    task = asyncio.create_task(periodic_loop())
 
     yield
 
-    for task in (scan_task, mailer_task):
-        if task:
-            task.cancel()
-            with contextlib.suppress(asyncio.CancelledError):
-                await task
+    task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await task
+
+    async with app.state.send_lock:
+        await asyncio.to_thread(mailer.close)
+    await http.aclose()
 
 
 app = FastAPI(title="menu-mailer", lifespan=lifespan)
 
+_HEALTH_RESPONSE = Response(content=b'{"status":"ok"}', media_type="application/json")
+
 
-@app.get("/health")
+@app.get("/health", include_in_schema=False)
 async def health():
-    return {"status": "ok"}
+    return _HEALTH_RESPONSE
 
 
 @app.get("/status")
@@ -85,16 +110,23 @@ async def status():
 @app.post("/send-now")
 async def send_now():
     mailer = app.state.mailer
-    return mailer.send_now()
+    async with app.state.send_lock:
+        result = await mailer.send_now()
+    app.state.wake.set()
+    return result
 
 
 def main() -> None:
     settings = get_settings()
+    setup_logging(settings)
     uvicorn.run(
         "src.app:app",
         host=settings.bind_host,
         port=settings.bind_port,
         log_level=settings.log_level.lower(),
+        loop="uvloop",
+        http="httptools",
+        access_log=False,
     )
 
 
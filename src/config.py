@@ -2,9 +2,9 @@
 
 import logging
 import sys
-from functools import lru_cache
+from functools import cached_property, lru_cache
 
-from pydantic_settings import BaseSettings
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -36,30 +36,34 @@ class Settings(BaseSettings):
 
     log_level: str = "INFO"
 
-    class Config:
-        """Pydantic settings configuration."""
-
-        env_file = "/app/config/app.env"
-        env_file_encoding = "utf-8"
-        extra = "ignore"
+    model_config = SettingsConfigDict(
+        env_file="/app/config/app.env",
+        env_file_encoding="utf-8",
+        extra="ignore",
+        frozen=True,
+    )
 
-    def recipient_list(self) -> list[str]:
+    @cached_property
+    def recipient_list(self) -> tuple[str, ...]:
         """Return parsed recipient list."""
 
-        return [addr.strip() for addr in self.mail_to.split(",") if addr.strip()]
+        return tuple(addr.strip() for addr in self.mail_to.split(",") if addr.strip())
 
 
 @lru_cache
 def get_settings() -> Settings:
-    """Get cached settings instance."""
+    """Get cached settings instance.
+
+    Intended for entrypoints only; request handlers and services receive the
+    instance stored on ``app.state.settings``.
+    """
 
     return Settings()
 
 
-def setup_logging() -> None:
+def setup_logging(settings: Settings) -> None:
     """Configure logging for the application."""
 
-    settings = get_settings()
     log_level = getattr(logging, settings.log_level.upper(), logging.INFO)
 
     log_format = (
@@ -2,18 +2,23 @@
 
 from __future__ import annotations
 
+import asyncio
+import base64
 import logging
+import os
 import smtplib
-import urllib.request
+import time
 from datetime import date, datetime, time as dt_time, timedelta, timezone
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from email.header import Header
+from email.utils import encode_rfc2231, formataddr, getaddresses
 from pathlib import Path
-from typing import Optional
+from threading import Lock
+from typing import NamedTuple, Optional
 from urllib.parse import urlencode, urlparse, urlunparse
 from zoneinfo import ZoneInfo
 
+import httpx
+
 from src.config import Settings
 from src.menu_index import MenuIndex
 
@@ -21,24 +26,125 @@ from src.menu_index import MenuIndex
 CHECK_INTERVAL_SECONDS = 30
 SEND_RETRY_INTERVAL_SECONDS = 120
 MISSING_LOG_INTERVAL_SECONDS = 300
+MAX_WAKE_INTERVAL_SECONDS = 3600
+
+# Boundaries contain "=_", which can never occur in base64 output, so every
+# part is base64-encoded and the payloads cannot collide with them.
+_RELATED_BOUNDARY = b"=_menu-mailer-related_="
+_ALTERNATIVE_BOUNDARY = b"=_menu-mailer-alternative_="
+_MIME_TEMPLATE = (
+    b"Subject: %(SUBJECT)s\r\n"
+    b"From: %(FROM)s\r\n"
+    b"To: %(TO)s\r\n"
+    b"MIME-Version: 1.0\r\n"
+    b'Content-Type: multipart/related; boundary="' + _RELATED_BOUNDARY + b'"\r\n'
+    b"\r\n"
+    b"--" + _RELATED_BOUNDARY + b"\r\n"
+    b'Content-Type: multipart/alternative; boundary="' + _ALTERNATIVE_BOUNDARY + b'"\r\n'
+    b"\r\n"
+    b"--" + _ALTERNATIVE_BOUNDARY + b"\r\n"
+    b'Content-Type: text/plain; charset="utf-8"\r\n'
+    b"Content-Transfer-Encoding: base64\r\n"
+    b"\r\n"
+    b"%(TEXT)s"
+    b"--" + _ALTERNATIVE_BOUNDARY + b"\r\n"
+    b'Content-Type: text/html; charset="utf-8"\r\n'
+    b"Content-Transfer-Encoding: base64\r\n"
+    b"\r\n"
+    b"%(HTML)s"
+    b"--" + _ALTERNATIVE_BOUNDARY + b"--\r\n"
+    b"--" + _RELATED_BOUNDARY + b"\r\n"
+    b"Content-Type: image/png\r\n"
+    b"Content-Transfer-Encoding: base64\r\n"
+    b"Content-ID: <menu-image>\r\n"
+    b"Content-Disposition: inline; %(FILENAME)s\r\n"
+    b"\r\n"
+    b"%(IMG)s"
+    b"--" + _RELATED_BOUNDARY + b"--\r\n"
+)
+
+
+def _encode_header(value: str) -> bytes:
+    if "\r" in value or "\n" in value:
+        raise ValueError(f"Header value contains a line break: {value!r}")
+    try:
+        return value.encode("ascii")
+    except UnicodeEncodeError:
+        return Header(value, "utf-8").encode(linesep="\r\n").encode("ascii")
+
+
+def _encode_addresses(value: str) -> bytes:
+    if value.isascii():
+        return _encode_header(value)
+    pairs = getaddresses([value])
+    return _encode_header(", ".join(formataddr(pair, charset="utf-8") for pair in pairs))
+
+
+def _encode_base64(data: bytes) -> bytes:
+    return base64.encodebytes(data).replace(b"\n", b"\r\n")
+
+
+def _encode_filename_param(name: str) -> bytes:
+    if name.isascii() and name.isprintable() and '"' not in name and "\\" not in name:
+        return f'filename="{name}"'.encode("ascii")
+    return f"filename*={encode_rfc2231(name, 'utf-8')}".encode("ascii")
+
+
+class _DailyWindow(NamedTuple):
+    day: date
+    day_start_ts: float
+    send_start_ts: float
+    send_start: datetime
+    send_deadline: datetime
+    skip: bool
 
 
 class MenuMailer:
     """Scheduler and sender for daily menu emails."""
 
-    def __init__(self, settings: Settings, index: MenuIndex) -> None:
+    def __init__(
+        self,
+        settings: Settings,
+        index: MenuIndex,
+        http: httpx.AsyncClient,
+        logger: Optional[logging.Logger] = None,
+    ) -> None:
         self._settings = settings
         self._index = index
-        self._logger = logging.getLogger("menu-mailer")
+        self._http = http
+        self._logger = logger or logging.getLogger("menu-mailer")
         self._timezone = self._load_timezone(settings.timezone)
+        self._send_time = dt_time(hour=settings.send_hour, minute=settings.send_minute)
+        self._retry_window = timedelta(minutes=settings.retry_window_minutes)
+
+        menu_web_base_url = settings.menu_web_base_url.rstrip("/")
+        parsed = urlparse(menu_web_base_url)
+        self._link_parts = (
+            parsed.scheme,
+            parsed.netloc,
+            parsed.path or "/",
+            parsed.params,
+            parsed.fragment,
+        )
+        self._image_url_prefix = f"{menu_web_base_url}/api/image/"
 
         self._last_sent_date: Optional[date] = None
         self._last_sent_at: Optional[datetime] = None
         self._last_attempt_at: Optional[datetime] = None
+        self._last_sent_date_iso: Optional[str] = None
+        self._last_sent_at_iso: Optional[str] = None
+        self._last_attempt_at_iso: Optional[str] = None
+        self._timezone_name: str = getattr(self._timezone, "key", "UTC")
         self._last_result: str = "idle"
         self._last_error: str = ""
         self._last_handled_date: Optional[date] = None
         self._last_missing_log_at: Optional[datetime] = None
+        self._message_cache: Optional[tuple[tuple[date, str, int, int], bytes]] = None
+        self._schedule_cache: Optional[_DailyWindow] = None
+        self._smtp: Optional[smtplib.SMTP] = None
+        # Held by worker threads for the whole SMTP exchange so close() cannot
+        # QUIT a session mid-send, even if the awaiting task was cancelled.
+        self._smtp_lock = Lock()
 
     def _load_timezone(self, tz_name: str) -> timezone:
         try:
@@ -47,10 +153,21 @@ class MenuMailer:
             self._logger.warning("Invalid timezone '%s', falling back to UTC", tz_name)
             return timezone.utc
 
-    def tick(self) -> None:
+    async def tick(self) -> None:
         """Perform a single scheduler tick."""
 
-        now = datetime.now(self._timezone)
+        # Before today's send window nothing can change, which is checkable
+        # against the cached epoch bounds without building a datetime.
+        now_ts = time.time()
+        cached = self._schedule_cache
+        if (
+            cached is not None
+            and not cached.skip
+            and cached.day_start_ts <= now_ts < cached.send_start_ts
+        ):
+            return
+
+        now = datetime.fromtimestamp(now_ts, self._timezone)
         today = now.date()
 
         if self._settings.skip_weekends and today.weekday() >= 5:
@@ -60,9 +177,7 @@ class MenuMailer:
                 self._last_handled_date = today
             return
 
-        send_time = dt_time(hour=self._settings.send_hour, minute=self._settings.send_minute)
-        send_start = datetime.combine(today, send_time, tzinfo=self._timezone)
-        send_deadline = send_start + timedelta(minutes=self._settings.retry_window_minutes)
+        send_start, send_deadline = self._daily_window(today)
 
         if now < send_start:
             return
@@ -79,6 +194,8 @@ class MenuMailer:
                 )
                 self._last_result = "missed"
                 self._last_handled_date = today
+                if self._smtp is not None:
+                    await asyncio.to_thread(self.close)
             return
 
         if self._last_attempt_at:
@@ -97,8 +214,9 @@ class MenuMailer:
             return
 
         self._last_attempt_at = now
+        self._last_attempt_at_iso = now.isoformat()
         try:
-            self._send_email(today, image_path)
+            await asyncio.to_thread(self._send_email, today, image_path)
         except Exception as exc:
             self._last_error = str(exc)
             self._last_result = "error"
@@ -107,20 +225,74 @@ class MenuMailer:
 
         self._last_sent_date = today
         self._last_sent_at = now
+        self._last_sent_date_iso = today.isoformat()
+        self._last_sent_at_iso = self._last_attempt_at_iso
         self._last_result = "sent"
         self._last_error = ""
         self._last_handled_date = today
         self._logger.info("Menu email sent for %s", today.isoformat())
-        self._notify_sent(today)
+        await self._notify_sent(today)
 
-    def send_now(self) -> dict:
+    def next_wake(self, now: Optional[datetime] = None) -> float:
+        """Return seconds until the next scheduler state transition."""
+
+        if now is None:
+            now = datetime.now(self._timezone)
+        today = now.date()
+        send_start, send_deadline = self._daily_window(today)
+
+        if (
+            (self._settings.skip_weekends and today.weekday() >= 5)
+            or self._last_sent_date == today
+            or now > send_deadline
+        ):
+            target, _ = self._send_window(today + timedelta(days=1))
+        elif now < send_start:
+            target = send_start
+        else:
+            # Inside the send window: poll for the image/config, honour the
+            # retry back-off and make sure the deadline itself is observed.
+            target = now + timedelta(seconds=CHECK_INTERVAL_SECONDS)
+            if self._last_attempt_at:
+                retry_at = self._last_attempt_at + timedelta(
+                    seconds=SEND_RETRY_INTERVAL_SECONDS
+                )
+                target = max(target, retry_at)
+            target = min(target, send_deadline + timedelta(seconds=1))
+
+        # Compare epoch timestamps so DST transitions are accounted for, and cap
+        # the sleep so wall-clock adjustments are picked up.
+        delta = target.timestamp() - now.timestamp()
+        return float(min(max(delta, 0.0), MAX_WAKE_INTERVAL_SECONDS))
+
+    def _daily_window(self, today: date) -> tuple[datetime, datetime]:
+        cached = self._schedule_cache
+        if cached is None or cached.day != today:
+            send_start, send_deadline = self._send_window(today)
+            day_start = datetime.combine(today, dt_time.min, tzinfo=self._timezone)
+            cached = _DailyWindow(
+                day=today,
+                day_start_ts=day_start.timestamp(),
+                send_start_ts=send_start.timestamp(),
+                send_start=send_start,
+                send_deadline=send_deadline,
+                skip=self._settings.skip_weekends and today.weekday() >= 5,
+            )
+            self._schedule_cache = cached
+        return cached.send_start, cached.send_deadline
+
+    def _send_window(self, day: date) -> tuple[datetime, datetime]:
+        send_start = datetime.combine(day, self._send_time, tzinfo=self._timezone)
+        return send_start, send_start + self._retry_window
+
+    async def send_now(self) -> dict:
         """Send the menu email immediately for today's date."""
 
         now = datetime.now(self._timezone)
         today = now.date()
 
         try:
-            self._index.scan()
+            await asyncio.to_thread(self._index.scan)
         except Exception:
             self._logger.exception("Failed to refresh menu image index")
 
@@ -136,8 +308,9 @@ class MenuMailer:
             return {"status": "config_error", "detail": self._last_error}
 
         self._last_attempt_at = now
+        self._last_attempt_at_iso = now.isoformat()
         try:
-            self._send_email(today, image_path)
+            await asyncio.to_thread(self._send_email, today, image_path)
         except Exception as exc:
             self._last_error = str(exc)
             self._last_result = "error"
@@ -146,16 +319,18 @@ class MenuMailer:
 
         self._last_sent_date = today
         self._last_sent_at = now
+        self._last_sent_date_iso = today.isoformat()
+        self._last_sent_at_iso = self._last_attempt_at_iso
         self._last_result = "sent"
         self._last_error = ""
         self._last_handled_date = today
 
-        self._notify_sent(today)
+        await self._notify_sent(today)
 
         return {
             "status": "sent",
-            "date": today.isoformat(),
-            "sent_at": now.isoformat(),
+            "date": self._last_sent_date_iso,
+            "sent_at": self._last_sent_at_iso,
         }
 
     def _log_missing_image(self, now: datetime, today: date) -> None:
@@ -172,7 +347,7 @@ class MenuMailer:
             missing.append("SMTP_HOST")
         if not self._settings.mail_from:
             missing.append("MAIL_FROM")
-        if not self._settings.recipient_list():
+        if not self._settings.recipient_list:
             missing.append("MAIL_TO")
 
         if missing:
@@ -187,10 +362,38 @@ class MenuMailer:
         return True
 
     def _send_email(self, menu_date: date, image_path: Path) -> None:
-        recipients = self._settings.recipient_list()
-        message = self._build_message(menu_date, image_path, recipients)
-        smtp = None
+        recipients = self._settings.recipient_list
+        raw_message = self._render_message(menu_date, image_path, recipients)
+
+        with self._smtp_lock:
+            smtp = self._get_smtp()
+            try:
+                smtp.sendmail(self._settings.mail_from, recipients, raw_message)
+            except (smtplib.SMTPResponseException, smtplib.SMTPRecipientsRefused):
+                # The server rejected the message but the session is still usable.
+                raise
+            except OSError:
+                self._smtp = None
+                smtp.close()
+                raise
+
+            # The session is only reused for retries inside the send window;
+            # once the day's email is out there is nothing left to send.
+            self._close_smtp()
+
+    def _get_smtp(self) -> smtplib.SMTP:
+        if self._smtp is not None:
+            try:
+                code, _ = self._smtp.noop()
+            except (smtplib.SMTPException, OSError):
+                code = None
+            if code == 250:
+                return self._smtp
+            self._logger.info("SMTP session is no longer usable, reconnecting")
+            self._smtp.close()
+            self._smtp = None
 
+        smtp = None
         try:
             if self._settings.smtp_use_tls and self._settings.smtp_port == 465:
                 smtp = smtplib.SMTP_SSL(
@@ -211,76 +414,93 @@ class MenuMailer:
 
             if self._settings.smtp_username:
                 smtp.login(self._settings.smtp_username, self._settings.smtp_password)
-
-            smtp.send_message(message, from_addr=self._settings.mail_from, to_addrs=recipients)
-        finally:
+        except Exception:
             if smtp is not None:
-                try:
-                    smtp.quit()
-                except Exception:
-                    self._logger.warning("SMTP session did not close cleanly")
-
-    def _build_message(
-        self, menu_date: date, image_path: Path, recipients: list[str]
-    ) -> MIMEMultipart:
+                smtp.close()
+            raise
+
+        self._smtp = smtp
+        return smtp
+
+    def close(self) -> None:
+        """Close the cached SMTP session, if any."""
+
+        with self._smtp_lock:
+            self._close_smtp()
+
+    def _close_smtp(self) -> None:
+        smtp, self._smtp = self._smtp, None
+        if smtp is None:
+            return
+        try:
+            smtp.quit()
+        except Exception:
+            self._logger.warning("SMTP session did not close cleanly")
+            smtp.close()
+
+    def _render_message(
+        self, menu_date: date, image_path: Path, recipients: tuple[str, ...]
+    ) -> bytes:
+        stat = os.stat(image_path)
+        key = (menu_date, str(image_path), stat.st_mtime_ns, stat.st_size)
+        if self._message_cache is not None and self._message_cache[0] == key:
+            return self._message_cache[1]
+
+        with image_path.open("rb") as handle:
+            image_data = handle.read()
+        raw_message = self._build_raw_message(
+            menu_date, image_path.name, image_data, recipients
+        )
+        self._message_cache = (key, raw_message)
+        return raw_message
+
+    def _build_raw_message(
+        self,
+        menu_date: date,
+        image_name: str,
+        image_data: bytes,
+        recipients: tuple[str, ...],
+    ) -> bytes:
         menu_link = self._build_menu_link(menu_date)
-        subject = self._format_subject(menu_date)
-        message = MIMEMultipart("related")
-        message["Subject"] = subject
-        message["From"] = self._settings.mail_from
-        message["To"] = ", ".join(recipients)
+        display_date = self._format_display_date(menu_date)
 
-        alternative = MIMEMultipart("alternative")
         text_body = (
-            f"School menu for {menu_date.isoformat()} is attached.\n"
+            f"School menu for {menu_date.isoformat()} is attached.\r\n"
             f"View in browser: {menu_link}"
         )
         html_body = (
             "<html><body>"
             '<img src="cid:menu-image" alt="School menu">'
-            f"<p>School menu for {self._format_display_date(menu_date)}.</p>"
+            f"<p>School menu for {display_date}.</p>"
             f'<p><a href="{menu_link}">Open calendar view</a></p>'
             "</body></html>"
         )
 
-        alternative.attach(MIMEText(text_body, "plain"))
-        alternative.attach(MIMEText(html_body, "html"))
-        message.attach(alternative)
-
-        with image_path.open("rb") as handle:
-            image = MIMEImage(handle.read(), _subtype="png")
-        image.add_header("Content-ID", "<menu-image>")
-        image.add_header("Content-Disposition", "inline", filename=image_path.name)
-        message.attach(image)
-
-        return message
+        return _MIME_TEMPLATE % {
+            b"SUBJECT": _encode_header(self._format_subject(display_date)),
+            b"FROM": _encode_addresses(self._settings.mail_from),
+            b"TO": _encode_addresses(", ".join(recipients)),
+            b"TEXT": _encode_base64(text_body.encode("utf-8")),
+            b"HTML": _encode_base64(html_body.encode("utf-8")),
+            b"FILENAME": _encode_filename_param(image_name),
+            b"IMG": _encode_base64(image_data),
+        }
 
     def _build_menu_link(self, menu_date: date) -> str:
-        base_url = self._settings.menu_web_base_url.rstrip("/")
-        parsed = urlparse(base_url)
+        scheme, netloc, path, params, fragment = self._link_parts
         query = urlencode({"date": menu_date.isoformat()})
-        return urlunparse(
-            (
-                parsed.scheme,
-                parsed.netloc,
-                parsed.path or "/",
-                parsed.params,
-                query,
-                parsed.fragment,
-            )
-        )
+        return urlunparse((scheme, netloc, path, params, query, fragment))
 
     def _build_menu_image_url(self, menu_date: date) -> str:
-        base_url = self._settings.menu_web_base_url.rstrip("/")
-        return f"{base_url}/api/image/{menu_date.isoformat()}"
+        return self._image_url_prefix + menu_date.isoformat()
 
-    def _notify_sent(self, menu_date: date) -> None:
+    async def _notify_sent(self, menu_date: date) -> None:
         try:
-            self._send_ntfy(menu_date)
+            await self._send_ntfy(menu_date)
         except Exception:
             self._logger.exception("Failed to send ntfy notification")
 
-    def _send_ntfy(self, menu_date: date) -> None:
+    async def _send_ntfy(self, menu_date: date) -> None:
         base_url = self._settings.ntfy_base_url.strip()
         topic = self._settings.ntfy_topic.strip()
         if not base_url or not topic:
@@ -293,38 +513,33 @@ class MenuMailer:
         display_date = self._format_display_date(menu_date)
         message = f"."
 
-        request = urllib.request.Request(
+        response = await self._http.post(
             url,
-            data=message.encode("utf-8"),
-            method="POST",
+            content=message.encode("utf-8"),
+            headers={
+                "Content-Type": "text/plain; charset=utf-8",
+                "Title": self._format_subject(display_date),
+                "Click": menu_link,
+                "Attach": menu_image_url,
+                "Filename": f"menu-{menu_date.isoformat()}.png",
+            },
         )
-        request.add_header("Content-Type", "text/plain; charset=utf-8")
-        request.add_header("Title", f"School menu - {display_date}")
-        request.add_header("Click", menu_link)
-        request.add_header("Attach", menu_image_url)
-        request.add_header("Filename", f"menu-{menu_date.isoformat()}.png")
-
-        with urllib.request.urlopen(request, timeout=10) as response:
-            response.read()
+        response.raise_for_status()
 
-    def _format_subject(self, menu_date: date) -> str:
-        return f"School menu - {self._format_display_date(menu_date)}"
+    def _format_subject(self, display_date: str) -> str:
+        return f"School menu - {display_date}"
 
     def _format_display_date(self, menu_date: date) -> str:
-        return f"{menu_date.strftime('%a')} {menu_date.day} {menu_date.strftime('%b')}"
+        return menu_date.strftime(f"%a {menu_date.day} %b")
 
     def status(self) -> dict:
         """Return a status payload."""
 
         return {
-            "last_sent_date": self._last_sent_date.isoformat()
-            if self._last_sent_date
-            else None,
-            "last_sent_at": self._last_sent_at.isoformat() if self._last_sent_at else None,
-            "last_attempt_at": self._last_attempt_at.isoformat()
-            if self._last_attempt_at
-            else None,
+            "last_sent_date": self._last_sent_date_iso,
+            "last_sent_at": self._last_sent_at_iso,
+            "last_attempt_at": self._last_attempt_at_iso,
             "last_result": self._last_result,
             "last_error": self._last_error,
-            "timezone": getattr(self._timezone, "key", "UTC"),
+            "timezone": self._timezone_name,
         }
@@ -3,79 +3,141 @@
 from __future__ import annotations
 
 import logging
-import re
-from datetime import date, datetime, timezone
+import os
+from datetime import datetime, timezone
 from pathlib import Path
 from threading import Lock
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple
 
 
-DATE_PATTERN = re.compile(r"^(?P<date>\d{4}-\d{2}-\d{2})(?:_.+)?\.png$", re.IGNORECASE)
+# Directory mtimes this recent are not trusted for the unchanged-directory
+# short-circuit: a file added within the same timestamp tick would be missed.
+MTIME_SETTLE_SECONDS = 2
+
+
+def _parse_date_prefix(name: str) -> Optional[str]:
+    """Return the date prefix of ``YYYY-MM-DD[_suffix].png`` names, else None."""
+
+    length = len(name)
+    if length != 14 and (length < 16 or name[10] != "_"):
+        return None
+    if name[4] != "-" or name[7] != "-" or name[-4:].lower() != ".png":
+        return None
+
+    date_str = name[:10]
+    if not (
+        date_str.isascii()
+        and date_str[:4].isdigit()
+        and date_str[5:7].isdigit()
+        and date_str[8:].isdigit()
+    ):
+        return None
+    if not 1 <= int(date_str[5:7]) <= 12 or not 1 <= int(date_str[8:]) <= 31:
+        return None
+
+    return date_str
 
 
 class MenuIndex:
-    """Scan a directory and index menu images by date."""
+    """Scan a directory and index menu images by date.
+
+    Readers dereference ``_date_to_path`` without locking; scans build a new
+    dict and publish it with a single attribute assignment. The published dict
+    must never be mutated in place. This only holds with one writer at a time,
+    so scans are serialised on ``_scan_lock``.
+    """
 
-    def __init__(self, menu_image_dir: str) -> None:
+    def __init__(
+        self, menu_image_dir: str, logger: Optional[logging.Logger] = None
+    ) -> None:
         self._menu_image_dir = Path(menu_image_dir)
-        self._lock = Lock()
         self._date_to_path: Dict[str, Path] = {}
-        self._last_scan: Optional[datetime] = None
-        self._logger = logging.getLogger("menu-mailer.index")
+        self._last_scan_iso: Optional[str] = None
+
+        # Writer-only state, only touched while holding _scan_lock.
+        self._scan_lock = Lock()
+        self._signature: Dict[str, Tuple[str, int]] = {}
+        self._dir_mtime_ns: Optional[int] = None
+        self._logger = logger or logging.getLogger("menu-mailer.index")
 
     def scan(self) -> None:
-        """Scan the menu directory and rebuild the index."""
+        """Scan the menu directory and rebuild the index if it changed."""
+
+        with self._scan_lock:
+            self._scan()
 
+    def _scan(self) -> None:
         scan_time = datetime.now(timezone.utc)
         new_map: Dict[str, Path] = {}
+        signature: Dict[str, Tuple[str, int]] = {}
 
-        if not self._menu_image_dir.exists():
+        try:
+            dir_stat = os.stat(self._menu_image_dir)
+        except FileNotFoundError:
             self._logger.warning(
                 "Menu image directory does not exist: %s", self._menu_image_dir
             )
-            self._update_index(new_map, scan_time)
+            self._update_index(new_map, signature, None, scan_time)
+            return
+        except OSError:
+            self._logger.exception("Failed to stat menu image directory")
+            self._update_index(new_map, signature, None, scan_time)
+            return
+
+        if dir_stat.st_mtime_ns == self._dir_mtime_ns and self._date_to_path:
+            self._set_last_scan(scan_time)
             return
 
         try:
-            for entry in self._menu_image_dir.iterdir():
-                if not entry.is_file():
-                    continue
-                if entry.suffix.lower() != ".png":
-                    continue
-
-                match = DATE_PATTERN.match(entry.name)
-                if not match:
-                    continue
-
-                date_str = match.group("date")
-                try:
-                    date.fromisoformat(date_str)
-                except ValueError:
-                    continue
-
-                existing = new_map.get(date_str)
-                if existing is None or entry.name < existing.name:
-                    new_map[date_str] = entry
+            with os.scandir(self._menu_image_dir) as entries:
+                for entry in entries:
+                    name = entry.name
+                    date_str = _parse_date_prefix(name)
+                    if date_str is None:
+                        continue
+                    if not entry.is_file():
+                        continue
+
+                    existing = new_map.get(date_str)
+                    if existing is None or name < existing.name:
+                        new_map[date_str] = Path(entry.path)
+                        signature[date_str] = (name, entry.inode())
         except OSError:
             self._logger.exception("Failed to scan menu image directory")
-
-        self._update_index(new_map, scan_time)
-
-    def _update_index(self, new_map: Dict[str, Path], scan_time: datetime) -> None:
-        with self._lock:
+            dir_mtime_ns = None
+        else:
+            if scan_time.timestamp() - dir_stat.st_mtime < MTIME_SETTLE_SECONDS:
+                dir_mtime_ns = None
+            else:
+                dir_mtime_ns = dir_stat.st_mtime_ns
+
+        self._update_index(new_map, signature, dir_mtime_ns, scan_time)
+
+    def _update_index(
+        self,
+        new_map: Dict[str, Path],
+        signature: Dict[str, Tuple[str, int]],
+        dir_mtime_ns: Optional[int],
+        scan_time: datetime,
+    ) -> None:
+        # Called with _scan_lock held, so the map, its signature and the
+        # directory mtime it was built from always change together. The same
+        # dict stays published when the (name, inode) set is unchanged.
+        if signature != self._signature:
             self._date_to_path = new_map
-            self._last_scan = scan_time
+            self._signature = signature
+        self._dir_mtime_ns = dir_mtime_ns
+        self._set_last_scan(scan_time)
+
+    def _set_last_scan(self, scan_time: datetime) -> None:
+        self._last_scan_iso = scan_time.isoformat()
 
     def get_image_path(self, date_str: str) -> Optional[Path]:
         """Return the image path for a given date string."""
 
-        with self._lock:
-            return self._date_to_path.get(date_str)
+        return self._date_to_path.get(date_str)
 
     def last_scan_iso(self) -> Optional[str]:
         """Return the last scan timestamp as an ISO string."""
 
-        with self._lock:
-            if self._last_scan is None:
-                return None
-            return self._last_scan.isoformat()
+        return self._last_scan_iso